@@ -10,6 +10,10 @@ from pagexml.model.physical_document_model import Coords
 
 import globalise_tools.tools as gt
 
+# one timestamp per run: computing and formatting the time per annotation adds up
+# on exports with millions of annotations
+GENERATED = datetime.today().isoformat()
+
 
 @dataclass
 class Document:
@@ -89,7 +93,7 @@ class WebAnnotation:
             "id": f"urn:globalise:annotation:{anno_uuid}",
             "type": "Annotation",
             "motivation": "classifying",
-            "generated": datetime.today().isoformat(),  # use last-modified from pagexml for px: types
+            "generated": GENERATED,  # use last-modified from pagexml for px: types
             "generator": {  # use creator metadata from pagexml for px: types
                 "id": "https://github.com/knaw-huc/loghi-htr",
                 "type": "Software",
@@ -110,9 +114,9 @@ class TRVersions:
     conll: str
 
 
-@dataclass_json
 @dataclass
 class GTToken:
+    __slots__ = ("text", "text_with_ws", "offset")
     text: str
     text_with_ws: str
     offset: int
@@ -128,12 +132,60 @@ class ScanCoords:
 
 class AnnotationEncoder(JSONEncoder):
     def default(self, obj):
-        if isinstance(obj, gt.Annotation) \
-                or isinstance(obj, gt.PXTextRegion) \
-                or isinstance(obj, gt.PXTextLine) \
-                or isinstance(obj, ScanCoords) \
-                or isinstance(obj, GTToken):
-            return obj.to_dict()
+        if isinstance(obj, gt.Annotation):
+            return {
+                "type": obj.type,
+                "id": obj.id,
+                "page_id": obj.page_id,
+                "physical_span": obj.physical_span,
+                "logical_span": obj.logical_span,
+                "metadata": obj.metadata
+            }
+        elif isinstance(obj, gt.TextSpan):
+            return {
+                "offset": obj.offset,
+                "length": obj.length,
+                "begin_anchor": obj.begin_anchor,
+                "end_anchor": obj.end_anchor,
+                "char_start": obj.char_start,
+                "char_end_exclusive": obj.char_end_exclusive,
+                "textrepo_version_id": obj.textrepo_version_id
+            }
+        elif isinstance(obj, gt.PXTextRegion):
+            return {
+                "id": obj.id,
+                "page_id": obj.page_id,
+                "coords": obj.coords,
+                "first_line_id": obj.first_line_id,
+                "last_line_id": obj.last_line_id,
+                "first_word_id": obj.first_word_id,
+                "last_word_id": obj.last_word_id,
+                "segment_length": obj.segment_length,
+                "structure_type": obj.structure_type,
+                "text": obj.text
+            }
+        elif isinstance(obj, gt.PXTextLine):
+            return {
+                "id": obj.id,
+                "text_region_id": obj.text_region_id,
+                "page_id": obj.page_id,
+                "coords": obj.coords,
+                "first_word_id": obj.first_word_id,
+                "last_word_id": obj.last_word_id,
+                "text": obj.text
+            }
+        elif isinstance(obj, ScanCoords):
+            return {
+                "iiif_base_uri": obj.iiif_base_uri,
+                "canvas_id": obj.canvas_id,
+                "coords": obj.coords
+            }
+        elif isinstance(obj, GTToken):
+            return {
+                "text": obj.text,
+                "text_with_ws": obj.text_with_ws,
+                "offset": obj.offset
+            }
         elif isinstance(obj, WebAnnotation):
             return obj.wrapped()
         elif isinstance(obj, Coords):
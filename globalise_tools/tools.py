@@ -1,5 +1,7 @@
 import csv
+import sys
 from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import List, Any, Tuple, Dict, Union
 
 from dataclasses_json import dataclass_json
@@ -125,8 +127,7 @@ class WebAnnotationFactory:
             canvas_target = self._canvas_target(canvas_url=canvas_id, xywh_list=xywh_list, coords_list=points)
             targets.append(canvas_target)
         if annotation.type == PAGE_TYPE:
-            iiif_base_url = self.get_iiif_base_url(page_id)
-            iiif_url = f"{iiif_base_url}/full/max/0/default.jpg"
+            iiif_url = self.get_full_iiif_url(page_id)
             targets.extend([
                 {
                     "source": iiif_url,
@@ -148,6 +149,7 @@ class WebAnnotationFactory:
         return f"{coords.left},{coords.top},{coords.width},{coords.height}"
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def _get_canvas_id(page_id):
         parts = page_id.split('_')
         inventory_number = parts[-2]
@@ -158,15 +160,17 @@ class WebAnnotationFactory:
     def _init_iiif_base_url_idx(self, path: str):
         logger.info(f"<= {path}...")
         with open(path) as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                self.iiif_base_url_idx[row["pagexml_id"]] = row["iiif_base_url"]
+            reader = csv.reader(f)
+            header = next(reader)
+            id_col = header.index("pagexml_id")
+            url_col = header.index("iiif_base_url")
+            self.iiif_base_url_idx.update((row[id_col], row[url_col]) for row in reader)
         logger.info("... done")
 
     def _make_image_targets(self, page_id: str, coords: List[Coords]) -> List[Dict[str, Any]]:
         targets = []
         iiif_base_url = self.get_iiif_base_url(page_id)
-        iiif_url = f"{iiif_base_url}/full/max/0/default.jpg"
+        iiif_url = self.get_full_iiif_url(page_id)
         selectors = []
         for c in coords:
             xywh = f"{c.box['x']},{c.box['y']},{c.box['w']},{c.box['h']}"
@@ -194,6 +198,10 @@ class WebAnnotationFactory:
 
         return targets
 
+    @lru_cache(maxsize=None)
+    def get_full_iiif_url(self, page_id: str) -> str:
+        return f"{self.get_iiif_base_url(page_id)}/full/max/0/default.jpg"
+
     def get_iiif_base_url(self, page_id: str) -> str:
         if page_id not in self.iiif_base_url_idx:
             logger.error(f"{page_id} not found in {self._iiif_mapping_file}")
@@ -302,9 +310,14 @@ class WebAnnotationFactory:
         height = 0
         width = 0
         for coords in coords_list:
-            height = max(height, max([c[1] for c in coords]))
-            width = max(width, max([c[0] for c in coords]))
-            path_def = ' '.join([f"L{c[0]} {c[1]}" for c in coords]) + " Z"
+            parts = []
+            for x, y in coords:
+                if x > width:
+                    width = x
+                if y > height:
+                    height = y
+                parts.append(f"L{x} {y}")
+            path_def = ' '.join(parts) + " Z"
             path_def = 'M' + path_def[1:]
             path_defs.append(path_def)
         path = f"""<path d="{' '.join(path_defs)}"/>"""
@@ -314,6 +327,7 @@ class WebAnnotationFactory:
         }
 
 
+@lru_cache(maxsize=None)
 def na_url(file_path):
     file_name = file_path.split('/')[-1]
     file = file_name.replace('.xml', '')
@@ -321,6 +335,7 @@ def na_url(file_path):
     return f"https://www.nationaalarchief.nl/onderzoeken/archief/1.04.02/invnr/{inv_nr}/file/{file}"
 
 
+@lru_cache(maxsize=None)
 def tr_url(file_path):
     file_name = file_path.split('/')[-1]
     basename = file_name.replace('.xml', '')
@@ -400,7 +415,8 @@ def extract_px_elements(scan_doc: PageXMLScan) -> (List[PXTextRegion], List[PXTe
     text_regions = []
     text_lines = []
     px_words = []
-    page_id = scan_doc.id.replace(".jpg", "")
+    # interned: this id is compared and hashed for every annotation on the page
+    page_id = sys.intern(scan_doc.id.removesuffix(".jpg"))
     for tr in scan_doc.get_text_regions_in_reading_order():
         collect_elements_from_text_region(tr, page_id, px_words, text_lines, text_regions)
     return text_regions, text_lines, px_words
@@ -484,7 +500,7 @@ def read_missive_metadata(meta_path):
 
 
 def make_id_prefix(scan_doc: PageXMLScan) -> str:
-    return "urn:globalise:" + scan_doc.id.replace(".jpg", "")
+    return sys.intern("urn:globalise:" + scan_doc.id.removesuffix(".jpg"))
 
 
 def page_annotation(
@@ -573,7 +589,7 @@ def text_line_annotation(
     )
 
 
-def word_annotation(id_prefix, stripped, text, w) -> Annotation:
+def word_annotation(id_prefix, stripped, w) -> Annotation:
     return Annotation(
         type="tt:Word",
         id=make_word_id(id_prefix, w),
@@ -583,7 +599,7 @@ def word_annotation(id_prefix, stripped, text, w) -> Annotation:
         metadata={
             "type": "WordMetadata",
             "text": stripped,
-            "coords": [pxw.coords for pxw in w.px_words]
+            "coords": tuple(pxw.coords for pxw in w.px_words)
         }
     )
 
@@ -619,7 +635,7 @@ def token_annotation(base_name, page_id, token_num, offset, token_length, token_
 
 
 def make_word_id(prefix: str, w) -> str:
-    return prefix + ":word:" + ":".join([pxw.id for pxw in w.px_words])
+    return prefix + ":word:" + ":".join(pxw.id for pxw in w.px_words)
 
 
 def make_textline_id(prefix: str, line_id) -> str:
@@ -704,17 +720,17 @@ def print_annotations(cas):
 
 
 def join_words(px_words):
-    text = ""
+    parts = []
     last_text_region = None
     last_line = None
     for w in px_words:
         if w.text_region_id == last_text_region:
             if w.line_id != last_line:
-                text += "|\n"
-            text += " "
+                parts.append("|\n")
+            parts.append(" ")
         else:
-            text += "\n\n"
-        text += w.text
+            parts.append("\n\n")
+        parts.append(w.text)
         last_text_region = w.text_region_id
         last_line = w.line_id
-    return text.strip()
+    return "".join(parts).strip()
@@ -1,11 +1,17 @@
 #!/usr/bin/env python3
 import argparse
+import bisect
 import csv
 import itertools
-import json
+import multiprocessing
 import os
+import sys
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from typing import List, AnyStr, Dict, Any, Tuple
 
+import orjson
 import pagexml.parser as pxp
 import spacy
 from icecream import ic
@@ -25,6 +31,14 @@ metadata_records = []
 ground_truth = []
 tr_versions: Dict[str, TRVersions] = {}
 nlp = None
+# set by init_spacy in the directory-group workers, where the per-document
+# pagexml pool must stay disabled
+in_group_worker = False
+
+_annotation_default = AnnotationEncoder().default
+# orjson serializes dataclasses natively and would bypass _annotation_default
+# (notably WebAnnotation.wrapped()), so route them through the default hook
+_orjson_options = orjson.OPT_INDENT_2 | orjson.OPT_PASSTHROUGH_DATACLASS
 
 
 def list_pagexml_files(directory: str):
@@ -49,36 +63,40 @@ def process_pagexml(path: str, document_id: str):
     px_text_regions, px_text_lines, px_words = gt.extract_px_elements(scan_doc)
     id_dispenser = gt.IdDispenser(id_prefix)
     display_words = gt.to_display_words(px_words, id_dispenser)
-    text = ''
+    parts = []
+    offset = 0
     display_word_range_idx = {}
     for w in display_words:
         stripped = w.text.strip()
-        wa = gt.word_annotation(id_prefix, stripped, text, w)
-        annotations.append(wa)
-        display_word_range_idx[w.id] = (wa.offset, wa.offset + wa.length)
-        text += w.text
+        annotations.append(gt.word_annotation(id_prefix, stripped, w))
+        display_word_range_idx[w.id] = (offset, offset + len(stripped))
+        parts.append(w.text)
+        offset += len(w.text)
+    text = "".join(parts)
     px_word_range_idx = index_word_ranges(display_words, display_word_range_idx)
 
-    paragraphs = [f'{p}\n' for p in text.split("\n")]
-    total_size = len("".join(paragraphs))
+    # the page text has no trailing newline of its own, but every line — the
+    # last one included — must come out newline-terminated, and total_size
+    # counts that final byte
+    paragraphs = f"{text}\n".splitlines(keepends=True)
+    total_size = len(text) + 1
 
     page_id = to_base_name(path)
     annotations.append(
         gt.page_annotation(id_prefix, page_id, path, total_size, document_id)
     )
 
+    _word_range = px_word_range_idx.__getitem__
     for text_region in px_text_regions:
-        offset = px_word_range_idx[text_region.first_word_id][0]
-        last_word_range = px_word_range_idx[text_region.last_word_id]
-        length = last_word_range[1] - offset
+        offset = _word_range(text_region.first_word_id)[0]
+        length = _word_range(text_region.last_word_id)[1] - offset
         annotations.append(
             gt.text_region_annotation(text_region, id_prefix)
         )
 
     for text_line in px_text_lines:
-        offset = px_word_range_idx[text_line.first_word_id][0]
-        last_word_range = px_word_range_idx[text_line.last_word_id]
-        length = last_word_range[1] - offset
+        offset = _word_range(text_line.first_word_id)[0]
+        length = _word_range(text_line.last_word_id)[1] - offset
         annotations.append(
             gt.text_line_annotation(text_line, id_prefix, offset, length)
         )
@@ -89,8 +107,8 @@ def to_conll2002(token: str) -> str:
     return "\n" if token in ["", "\n"] else f"{token} O\n"
 
 
-def as_conll2002(tokens: List[str]) -> List[str]:
-    return [to_conll2002(t) for t in tokens]
+def as_conll2002(tokens: List[str]) -> str:
+    return "".join(to_conll2002(t) for t in tokens)
 
 
 def export(base_name: AnyStr,
@@ -103,44 +121,44 @@ def export(base_name: AnyStr,
 
     file_name = f"{base_name}.txt"
     print(f"exporting text to {file_name}")
-    with open(file_name, 'w', encoding='utf-8') as f:
-        f.writelines(all_text)
+    with open(file_name, 'w', encoding='utf-8', buffering=1 << 20) as f:
+        f.write("".join(all_text))
 
     file_name = f"{base_name}-tokens.json"
     print(f"exporting tokens to {file_name}")
-    with open(file_name, 'w', encoding='utf-8') as f:
-        json.dump(tokens, f, indent=2, cls=AnnotationEncoder)
+    with open(file_name, 'wb') as f:
+        f.write(orjson.dumps(tokens, default=_annotation_default, option=_orjson_options))
 
     file_name = f"{base_name}-segmented-text.json"
     print(f"exporting token segments to {file_name}")
-    with open(file_name, 'w', encoding='utf-8') as f:
+    with open(file_name, 'wb') as f:
         segments = [t.text_with_ws if t.text_with_ws else "\n" for t in tokens]
         wrapper = {
             "_ordered_segments": segments
         }
-        json.dump(wrapper, f, indent=2)
+        f.write(orjson.dumps(wrapper, default=_annotation_default, option=_orjson_options))
 
     file_name = f"{base_name}.conll"
     print(f"exporting tokens as CoNLL 2002 to {file_name}")
     token_texts = [t.text for t in tokens]
-    with open(file_name, 'w', encoding='utf-8') as f:
-        f.writelines(as_conll2002(token_texts))
+    with open(file_name, 'w', encoding='utf-8', buffering=1 << 20) as f:
+        f.write(as_conll2002(token_texts))
 
     metadata_file_name = f"{base_name}-metadata.json"
     print(f"exporting metadata to {metadata_file_name}")
-    with open(metadata_file_name, 'w', encoding='utf-8') as f:
-        json.dump(metadata, f, indent=2, cls=AnnotationEncoder)
+    with open(metadata_file_name, 'wb') as f:
+        f.write(orjson.dumps(metadata, default=_annotation_default, option=_orjson_options))
 
     file_name = f"{base_name}-web-annotations.json"
     print(f"exporting web annotations to {file_name}")
-    with open(file_name, 'w', encoding='utf-8') as f:
-        json.dump(web_annotations, f, indent=2, cls=AnnotationEncoder)
+    with open(file_name, 'wb') as f:
+        f.write(orjson.dumps(web_annotations, default=_annotation_default, option=_orjson_options))
 
     print()
 
 
 def to_base_name(path: str) -> str:
-    return path.split('/')[-1].replace(".xml", "")
+    return sys.intern(path.split('/')[-1].removesuffix(".xml"))
 
 
 def create_base_name(pagexml_files: List[str]) -> str:
@@ -169,15 +187,19 @@ def tokenize(all_pars: List[str]) -> (List[str], List[int]):
 
 def tokenize_per_paragraph(all_pars: List[str]) -> List[GTToken]:
     tokens = []
-    text_offset = 0
-    for par in all_pars:
-        doc = nlp(par)
-        for sentence in doc.sents:
-            for token in [t for t in sentence if t.text != "\n"]:
-                offset = text_offset + token.idx
-                tokens.append(GTToken(token.text, token.text_with_ws, offset))
+    par_ends = list(itertools.accumulate(len(p) for p in all_pars))
+    doc = nlp(''.join(all_pars))
+    par_idx = 0
+    for token in doc:
+        if token.text == "\n":
+            continue
+        while par_idx < len(par_ends) and token.idx >= par_ends[par_idx]:
+            tokens.append(GTToken("", "", -1))
+            par_idx += 1
+        tokens.append(GTToken(token.text, token.text_with_ws, token.idx))
+    while par_idx < len(par_ends):
         tokens.append(GTToken("", "", -1))
-        text_offset += len(par)
+        par_idx += 1
     return tokens
 
 
@@ -192,20 +214,48 @@ def read_metadata(basename: str) -> Dict[str, str]:
         return relevant[0]
 
 
-def get_page_id(offset: int, length: int, scan_ranges) -> str:
+def get_page_id(offset: int, length: int, scan_starts: List[int], scan_ends: List[int], scan_ids: List[str]) -> str:
     range_start = offset
     range_end = offset + length
-    overlapping_ranges = [sr for sr in scan_ranges.items()
-                          if sr[1][0] <= range_start < sr[1][1]]
-    if len(overlapping_ranges) == 1:
-        return overlapping_ranges[0][0]
+    k = bisect.bisect_right(scan_starts, range_start) - 1
+    if k >= 0 and range_start < scan_ends[k]:
+        return scan_ids[k]
     else:
-        ic(range_start, range_end, overlapping_ranges)
+        ic(range_start, range_end)
         return ":placeholder:"
 
 
+def bulk_page_ids(tokens: List[GTToken], scan_starts: List[int], scan_ends: List[int],
+                  scan_ids: List[str]) -> List[str]:
+    # token offsets increase monotonically, so one linear sweep over the sorted
+    # scan ranges resolves all page ids without a per-token search
+    page_ids = []
+    if not scan_ids:
+        return [None if t.offset < 0 else get_page_id(t.offset, len(t.text), scan_starts, scan_ends, scan_ids)
+                for t in tokens]
+    k = 0
+    last = len(scan_ids) - 1
+    for t in tokens:
+        offset = t.offset
+        if offset < 0:
+            page_ids.append(None)
+            continue
+        while k < last and offset >= scan_starts[k + 1]:
+            k += 1
+        if scan_starts[k] <= offset < scan_ends[k]:
+            page_ids.append(scan_ids[k])
+        else:
+            page_ids.append(get_page_id(offset, len(t.text), scan_starts, scan_ends, scan_ids))
+    return page_ids
+
+
 def make_token_annotations(base_name, tokens, scan_ranges):
     annotations = []
+    sorted_ranges = sorted(scan_ranges.items(), key=lambda sr: sr[1][0])
+    scan_ids = [sr[0] for sr in sorted_ranges]
+    scan_starts = [sr[1][0] for sr in sorted_ranges]
+    scan_ends = [sr[1][1] for sr in sorted_ranges]
+    token_page_ids = bulk_page_ids(tokens, scan_starts, scan_ends, scan_ids)
     par_offset = 0
     par_length = 0
     par_num = 1
@@ -216,7 +266,7 @@ def make_token_annotations(base_name, tokens, scan_ranges):
         offset = gp_token.offset
         token_is_paragraph_end = offset < 0
         if token_is_paragraph_end:
-            page_id = get_page_id(par_offset, par_length, scan_ranges)
+            page_id = get_page_id(par_offset, par_length, scan_starts, scan_ends, scan_ids)
             annotations.append(
                 gt.paragraph_annotation(base_name, page_id, par_num, par_offset, par_length, par_text.strip()))
             par_offset += par_length
@@ -224,7 +274,7 @@ def make_token_annotations(base_name, tokens, scan_ranges):
             par_text = ""
         else:
             token_length = len(token)
-            page_id = get_page_id(offset, token_length, scan_ranges)
+            page_id = token_page_ids[i]
             annotations.append(
                 gt.token_annotation(base_name=base_name, page_id=page_id, token_num=i, offset=offset,
                                     token_length=token_length, token_text=token, sentence_num=par_num))
@@ -246,24 +296,22 @@ def ranges_per_scan(annotations: List[gt.Annotation]) -> Dict[str, Tuple[int, in
     }
 
 
-def segment_range(tokens: List[GTToken], char_range_begin: int, char_range_end: int):
-    begin_idx = 0
-    end_idx = 0
-    for i, token in enumerate(tokens):
-        if -1 < token.offset <= char_range_begin:
-            begin_idx = i
-        if -1 < token.offset < char_range_end:
-            end_idx = i
-        elif -1 < token.offset:
-            break
+def segment_range(offsets: List[int], idx_map: List[int], char_range_begin: int, char_range_end: int):
+    b = bisect.bisect_right(offsets, char_range_begin) - 1
+    e = bisect.bisect_left(offsets, char_range_end) - 1
+    begin_idx = idx_map[b] if b >= 0 else 0
+    end_idx = idx_map[e] if e >= 0 else 0
     return begin_idx, end_idx
 
 
 def add_anchor_range(all_annotations: List[gt.Annotation], tokens: List[GTToken]):
+    offsets = [t.offset for t in tokens if t.offset >= 0]
+    idx_map = [i for i, t in enumerate(tokens) if t.offset >= 0]
     for a in all_annotations:
         char_range_begin = a.offset
         char_range_end = a.offset + a.length
-        a.physical_begin_anchor, a.physical_end_anchor = segment_range(tokens, char_range_begin, char_range_end)
+        a.physical_begin_anchor, a.physical_end_anchor = segment_range(offsets, idx_map, char_range_begin,
+                                                                       char_range_end)
 
 
 def doc_annotation(base_name: str):
@@ -290,7 +338,7 @@ def process_directory_group(document_id: str, directory_group: List[str],
     add_tr_versions(all_annotations, base_name)
     add_anchor_range(all_annotations, tokens)
 
-    all_annotations.sort(key=lambda a: f"{a.page_id} {a.offset:06d} {(1000 - a.length):06d}")
+    all_annotations.sort(key=lambda a: (a.page_id, a.offset, -a.length))
 
     # token_selection = [a for a in all_annotations if a.type == 'tt:Token'][:10]
     # ic(token_selection)
@@ -346,8 +394,16 @@ def process_pagexml_files(pagexml_files: List[str], document_id: str):
     all_pars = []
     all_annotations = []
     start_offset = 0
-    for f in pagexml_files:
-        (paragraphs, annotations, par_length) = process_pagexml(f, document_id)
+    if in_group_worker or multiprocessing.current_process().daemon:
+        # the cpus are already saturated by the directory-group workers
+        # (and daemonic workers can't spawn a pool of their own anyway)
+        results = [process_pagexml(f, document_id) for f in pagexml_files]
+    else:
+        with multiprocessing.Pool(os.cpu_count()) as pool:
+            results = pool.map(partial(process_pagexml, document_id=document_id), pagexml_files, chunksize=4)
+    # the files are independent, but the offsets depend on the sizes of the preceding files,
+    # so fold those in serially
+    for (paragraphs, annotations, par_length) in results:
         all_pars.extend(paragraphs)
         for annotation in annotations:
             annotation.offset += start_offset
@@ -363,8 +419,24 @@ def add_tr_versions(all_annotations, external_id):
 
 
 def init_spacy():
-    global nlp
-    nlp = spacy.load(spacy_core)
+    global nlp, in_group_worker
+    # the group workers must not each spawn a pagexml pool of their own
+    in_group_worker = True
+    # only the tokenizer + sentence boundaries (from the parser) are used, so skip the other components
+    nlp = spacy.load(spacy_core, disable=["tagger", "attribute_ruler", "lemmatizer", "ner", "morphologizer"])
+
+
+def init_group_worker():
+    init_spacy()
+    # under the spawn start method (the macOS default) workers re-import this
+    # module with empty csv globals instead of inheriting the parent's, so
+    # reload the small csv files here; forked workers skip the reload
+    if not metadata_records:
+        load_metadata()
+    if not ground_truth:
+        load_ground_truth()
+    if not tr_versions:
+        load_tr_versions()
 
 
 def load_metadata():
@@ -378,23 +450,33 @@ def load_metadata():
 
 def load_ground_truth():
     print(f"loading {ground_truth_csv}...", end=' ')
-    records = []
     with open(ground_truth_csv) as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            records.append(row)
-    joined_lines = [(r['scan'], r['line n'], r['line n+1']) for r in records if r['join?'] != '']
-    ground_truth.extend(joined_lines)
+        reader = csv.reader(f)
+        header = next(reader)
+        scan_col = header.index('scan')
+        line_n_col = header.index('line n')
+        line_n1_col = header.index('line n+1')
+        join_col = header.index('join?')
+        ground_truth.extend(
+            (row[scan_col], row[line_n_col], row[line_n1_col])
+            for row in reader
+            if row[join_col] != ''
+        )
     print()
 
 
 def load_tr_versions():
     print(f"loading {textrepo_version_csv}...", end=' ')
     with open(textrepo_version_csv) as f:
-        reader = csv.DictReader(f)
+        reader = csv.reader(f)
+        header = next(reader)
+        id_col = header.index('external_id')
+        txt_col = header.index('txt_version')
+        segmented_col = header.index('segmented_version')
+        conll_col = header.index('conll_version')
         for row in reader:
-            tr_versions[row['external_id']] = TRVersions(txt=row['txt_version'], segmented=row['segmented_version'],
-                                                         conll=row['conll_version'])
+            tr_versions[row[id_col]] = TRVersions(txt=row[txt_col], segmented=row[segmented_col],
+                                                  conll=row[conll_col])
     print()
 
 
@@ -421,21 +503,24 @@ def get_arguments():
 
 def process(directories, iiif_mapping_file, merge_sections):
     webannotation_factory = gt.WebAnnotationFactory(iiif_mapping_file)
-    init_spacy()
     load_metadata()
     load_ground_truth()
     load_tr_versions()
+    groups = defaultdict(list)
     if merge_sections:
-        def group_id(path):
-            return path.rstrip('/').split('/')[-1].split('_')[0]
-
-        groups = itertools.groupby(directories, group_id)
-        for group_id, group in groups:
-            process_directory_group(group_id, group, webannotation_factory)
+        for d in directories:
+            groups[d.rstrip('/').split('/')[-1].split('_')[0]].append(d)
     else:
         for d in directories:
-            group_id = d.split('/')[-1]
-            process_directory_group(group_id, [d], webannotation_factory)
+            groups[d.split('/')[-1]].append(d)
+    # the directory groups are fully independent (separate base_names and output files),
+    # so they can be processed in parallel. Each worker loads its own spaCy model and,
+    # when not forked from this process, the csv globals via the initializer.
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=init_group_worker) as executor:
+        futures = [executor.submit(process_directory_group, group_id, group, webannotation_factory)
+                   for group_id, group in groups.items()]
+        for future in futures:
+            future.result()
 
 
 @logger.catch
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import argparse
 import re
+from functools import lru_cache
 from typing import Tuple, List
 
 import spacy
@@ -14,8 +15,12 @@ from globalise_tools.tools import is_paragraph, paragraph_text, is_signature, is
 typesystem_xml = 'data/typesystem.xml'
 spacy_core = "nl_core_news_lg"
 
-logger.info(f"loading {spacy_core}")
-nlp = spacy.load(spacy_core)
+
+@lru_cache(maxsize=1)
+def get_nlp():
+    logger.info(f"loading {spacy_core}")
+    # only the tokenizer + sentence boundaries (from the parser) are used, so skip the other components
+    return spacy.load(spacy_core, disable=["tagger", "attribute_ruler", "lemmatizer", "ner", "morphologizer"])
 
 
 @logger.catch
@@ -57,7 +62,7 @@ def convert(page_xml_path: str):
         ParagraphAnnotation = cas.typesystem.get_type(CAS_PARAGRAPH)
         MarginaliumAnnotation = cas.typesystem.get_type(CAS_MARGINALIUM)
         HeaderAnnotation = cas.typesystem.get_type(CAS_HEADER)
-        doc = nlp(text)
+        doc = get_nlp()(text)
         for sentence in doc.sents:
             cas.add(SentenceAnnotation(begin=sentence.start_char, end=sentence.end_char))
             for token in [t for t in sentence if t.text != "\n"]:
@@ -108,23 +113,25 @@ def extract_paragraph_text(scan_doc) -> Tuple[str, List[Tuple[int, int]], Tuple[
     header_range = None
     paragraph_ranges = []
     offset = 0
-    text = ""
+    parts = []
+    text_len = 0
     for m in marginalia:
-        text += m
-        text_len = len(text)
+        parts.append(m)
+        text_len += len(m)
         marginalia_ranges.append((offset, text_len))
         offset = text_len
     if headers:
         h = headers[0]
-        text += f"\n{h}\n"
-        text_len = len(text)
+        parts.append(f"\n{h}\n")
+        text_len += len(h) + 2
         header_range = (offset + 1, text_len - 1)
         offset = text_len
     for m in paragraphs:
-        text += m
-        text_len = len(text)
+        parts.append(m)
+        text_len += len(m)
         paragraph_ranges.append((offset, text_len))
         offset = text_len
+    text = "".join(parts)
     if '  ' in text:
         logger.error('double space in text')
     return text, marginalia_ranges, header_range, paragraph_ranges
@@ -1,16 +1,21 @@
 #!/usr/bin/env python3
 import argparse
+import bisect
 import hashlib
-import json
+import heapq
+import os
+import pickle
 import re
 import uuid
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import lru_cache, partial
+from operator import itemgetter
 from typing import List, Dict, Any, Tuple
 
 import cassis as cas
+import orjson
 from cassis.typesystem import FeatureStructure
-from icecream import ic
-from intervaltree import IntervalTree, Interval
 from loguru import logger
 
 import globalise_tools.git_tools as git
@@ -95,6 +100,83 @@ ner_data_dict = {
 
 wiki_base = "https://github.com/globalise-huygens/nlp-event-detection/wiki#"
 
+
+# the categories, relation types and roles form small closed sets, so cache
+# the wiki urls instead of re-interpolating them per annotation
+@lru_cache(maxsize=None)
+def wiki_url(term: str) -> str:
+    return f"{wiki_base}{term}"
+
+
+@lru_cache(maxsize=None)
+def category_url(raw_category: str) -> str:
+    return wiki_url(raw_category.replace("+", "Plus").replace("-", "Min"))
+
+# the classifying bodies per NER label never change, so build them once;
+# shared by reference and never mutated
+ner_bodies = {
+    entity_id: [
+        {
+            "type": "SpecificResource",
+            "purpose": "classifying",
+            "source": {
+                "id": ner_data['uri'],
+                "label": ner_data['label']
+            }
+        }
+    ]
+    for entity_id, ner_data in ner_data_dict.items()
+}
+
+# static JSON-LD fragments, frozen at import time; shared by reference and never mutated
+anno_context = "http://www.w3.org/ns/anno.jsonld"
+
+fragment_selector_proto = {
+    "type": "FragmentSelector",
+    "conformsTo": "http://www.w3.org/TR/media-frags/"
+}
+
+entity_inference_context = [
+    anno_context,
+    {
+        "prov": "http://www.w3.org/ns/prov#",
+        "wasDerivedFrom": {
+            "@id": "prov:wasDerivedFrom",
+            "@type": "@id"
+        }
+    }
+]
+
+event_argument_body = {
+    "purpose": "classifying",
+    "source": "https://github.com/globalise-huygens/nlp-event-detection/wiki#EventArguments"
+}
+
+event_inference_context = [
+    anno_context,
+    {
+        "prov": "http://www.w3.org/ns/prov#",
+        "glob": "https://github.com/globalise-huygens/nlp-event-detection/wiki#",
+        "sem": "http://semanticweb.cs.vu.nl/2009/11/sem/",
+        "hasActor": "sem:hasActor",
+        "hasTime": "sem:hasTime",
+        "hasPlace": "sem:hasPlace",
+        "Event": "sem:Event",
+        "roleType": {
+            "@id": "sem:roleType",
+            "@type": "@id"
+        },
+        # "value": {
+        #     "@id": "rdf:value",
+        #     "@type": "@id"
+        # },
+        "wasDerivedFrom": {
+            "@id": "prov:wasDerivedFrom",
+            "@type": "@id"
+        }
+    }
+]
+
 time_roles = ["Time"]
 actor_roles = ["Agent", "AgentPatient", "Benefactive", "Cargo", "Instrument", "Patient"]
 place_roles = ["Location", "Path", "Source", "Target"]
@@ -103,57 +185,88 @@ place_roles = ["Location", "Path", "Source", "Target"]
 class XMIProcessor:
     max_fix_len = 20
 
-    def __init__(self, typesystem, document_data, commit_id: str, xmi_path: str):
+    NAMED_ENTITY_TYPE = "de.tudarmstadt.ukp.dkpro.core.api.ner.type.NamedEntity"
+    EVENT_TYPE = "webanno.custom.SemPredGLOB"
+    EVENT_ARGUMENT_TYPE = "webanno.custom.SemPredGLOBArgumentsLink"
+
+    def __init__(self, typesystem, document_data_md5_index, commit_id: str, xmi_path: str):
         self.typesystem = typesystem
-        self.document_data = document_data
+        self.document_data_md5_index = document_data_md5_index
         self.xmi_path = xmi_path
         self.commit_id = commit_id
+        # one timestamp per file; formatting the current time per annotation adds up
+        self._generated = datetime.now().isoformat()
         logger.info(f"<= {xmi_path}")
-        with open(xmi_path, 'rb') as f:
+        # the xml parser pulls many small reads, so use a 1 MiB buffer instead
+        # of the 8 KiB default
+        with open(xmi_path, 'rb', buffering=1 << 20) as f:
             self.cas = cas.load_cas_from_xmi(f, typesystem=self.typesystem)
         self.text = self.cas.get_sofa().sofaString
         self.text_len = len(self.text)
-        md5 = hashlib.md5(self.text.encode()).hexdigest()
-        data = None
-        self.document_id = "unknown"
-        for k, v in document_data.items():
-            if v['plain_text_md5'] == md5:
-                self.document_id = k
-                data = v
+        # hash in chunks: encoding the whole sofa text at once doubles peak memory
+        md5_hash = hashlib.md5()
+        chunk_size = 1 << 20
+        for i in range(0, self.text_len, chunk_size):
+            md5_hash.update(self.text[i:i + chunk_size].encode())
+        md5 = md5_hash.hexdigest()
+        self.document_id, data = document_data_md5_index.get(md5, ("unknown", None))
         self.event_argument_entity_dict = {}
+        self._partitioned = None
         # source_list = [d['plain_text_source'] for d in document_data.values() if d['plain_text_md5'] == md5]
         if data:
             self.plain_text_source = data['plain_text_source']
-            self.itree = IntervalTree([Interval(*iv) for iv in data['text_intervals']])
+            # the page intervals are sorted and (normally) non-overlapping, so per-annotation
+            # overlap queries only need a bisect into the begin offsets; no IntervalTree required
+            self._intervals = sorted((tuple(iv) for iv in data['text_intervals']),
+                                     key=lambda iv: (iv[0], iv[1]))
+            self._interval_begins = [iv[0] for iv in self._intervals]
+            self._interval_ends = [iv[1] for iv in self._intervals]
         else:
             # logger.error(f"No document data found for {xmi_path}, using placeholder target source")
             raise Exception(f"No document data found for {xmi_path}")
             # self.plain_text_source = "urn:placeholder"
-            # self.itree = IntervalTree()
+            # self._intervals = []
 
     def text(self) -> str:
         return self.text
 
+    def _partition_annotations(self):
+        # cassis' typed select uses the view's per-type index, so there is no
+        # Python-level type.name filtering over every annotation in the view
+        if self._partitioned is None:
+            view = self.cas.views[0]
+            self._partitioned = (
+                list(view.select(self.NAMED_ENTITY_TYPE)),
+                list(view.select(self.EVENT_TYPE)),
+                list(view.select(self.EVENT_ARGUMENT_TYPE))
+            )
+        return self._partitioned
+
     def get_named_entity_annotations(self):
-        entity_annotations = [a for a in self.cas.views[0].get_all_annotations() if
-                              a.type.name == "de.tudarmstadt.ukp.dkpro.core.api.ner.type.NamedEntity" and a.value]
+        entity_annotations = [a for a in self._partition_annotations()[0] if a.value]
+        # (start, annotation) pairs, so callers can order the merged output
+        # with a C-level itemgetter key instead of navigating the nested dicts
         web_annotations = []
         for a in entity_annotations:
+            begin = a['begin']
             web_annotation = self._as_web_annotation(a, self._named_entity_body(a))
-            web_annotations.append(web_annotation)
+            web_annotations.append((begin, web_annotation))
             entity_type = ner_data_dict[a['value']]['entity_type']
-            web_annotations.append(self._entity_inference_annotation(web_annotation, entity_type, a.xmiID))
+            web_annotations.append((begin, self._entity_inference_annotation(web_annotation, entity_type, a.xmiID)))
+        # the annotations are visited in near-document order, so this sort is
+        # close to linear and lets callers heapq.merge the per-type streams
+        web_annotations.sort(key=itemgetter(0))
         return web_annotations
 
     def get_event_annotations(self, entity_ids: list[str]):
-        event_annotations = [a for a in self.cas.views[0].get_all_annotations() if
-                             a.type.name == "webanno.custom.SemPredGLOB"]
+        event_annotations = self._partition_annotations()[1]
         web_annotations = []
         for event_annotation in event_annotations:
+            event_begin = event_annotation['begin']
             event_predicate_body = self._event_predicate_body(event_annotation)
             if event_predicate_body:
                 event_web_annotation = self._as_web_annotation(event_annotation, event_predicate_body)
-                web_annotations.append(event_web_annotation)
+                web_annotations.append((event_begin, event_web_annotation))
             else:
                 event_web_annotation = None
 
@@ -167,72 +280,95 @@ class XMIProcessor:
                     target_entity = re.sub(r"[^a-z0-9]+", "_", raw_target_entity.lower()).strip("_")
                     self.event_argument_entity_dict[argument_annotation.xmiID] = target_entity
 
-                    web_annotations.append(event_argument_web_annotation)
+                    argument_begin = event_argument_web_annotation['target'][0]['selector'][1]['start']
+                    if argument_begin is None:
+                        # error-path annotations have no position; fall back to
+                        # the event's so the sort keys stay comparable
+                        argument_begin = event_begin if event_begin is not None else -1
+                    web_annotations.append((argument_begin, event_argument_web_annotation))
                     if event_web_annotation:
-                        web_annotations.append(
+                        web_annotations.append((
+                            argument_begin,
                             self._as_event_link_web_annotation(
-                                f"{wiki_base}{argument_annotation['role']}",
+                                wiki_url(argument_annotation['role']),
                                 event_web_annotation['id'],
                                 event_argument_web_annotation['id']
                             )
-                        )
+                        ))
             if event_web_annotation:
-                web_annotations.append(self._event_inference_annotation(event_web_annotation, event_annotation))
+                web_annotations.append(
+                    (event_begin, self._event_inference_annotation(event_web_annotation, event_annotation)))
 
+        web_annotations.sort(key=itemgetter(0))
         return web_annotations
 
     def get_event_argument_annotations(self):
-        return [self._as_web_annotation(a, self._event_argument_body())
-                for a in self.cas.views[0].get_all_annotations()
-                if a.type.name == "webanno.custom.SemPredGLOBArgumentsLink"]
-
-    def _get_prefix(self, a) -> str:
-        if not a:
+        annotations = []
+        for a in self._partition_annotations()[2]:
+            web_annotation = self._as_web_annotation(a, self._event_argument_body())
+            # link structures carry no span of their own: take the resolved
+            # target position, or sort span-less error cases first
+            begin = web_annotation['target'][0]['selector'][1]['start']
+            annotations.append((begin if begin is not None else -1, web_annotation))
+        annotations.sort(key=itemgetter(0))
+        return annotations
+
+    def _get_prefix(self, begin: int) -> str:
+        if begin is None:
             return ""
-        extended_prefix_begin = max(0, a['begin'] - self.max_fix_len * 2)
-        extended_prefix = self.text[extended_prefix_begin:a['begin']].lstrip().replace('\n', ' ')
-        first_space_index = extended_prefix.rfind(' ', 0, self.max_fix_len)
-        if first_space_index != -1:
-            prefix = extended_prefix[first_space_index + 1:]
-        else:
-            prefix = extended_prefix
-        return prefix
-
-    def _get_suffix(self, a) -> str:
-        if not a:
+        # scan a 2 * max_fix_len window on the document text itself and only
+        # slice the final snippet; cutting at the last space (or newline) in
+        # the far half keeps between max_fix_len and 2 * max_fix_len chars
+        window_start = max(0, begin - self.max_fix_len * 2)
+        while window_start < begin and self.text[window_start].isspace():
+            window_start += 1
+        half_end = min(window_start + self.max_fix_len, begin)
+        cut = max(self.text.rfind(' ', window_start, half_end),
+                  self.text.rfind('\n', window_start, half_end))
+        if cut != -1:
+            window_start = cut + 1
+        return self.text[window_start:begin].replace('\n', ' ')
+
+    def _get_suffix(self, end: int) -> str:
+        if end is None:
             return ""
-        extended_suffix_end = min(self.text_len, a['end'] + self.max_fix_len * 2)
-        extended_suffix = self.text[a['end']:extended_suffix_end].rstrip().replace('\n', ' ')
-        last_space_index = extended_suffix.rfind(' ', 0, self.max_fix_len)
-        if last_space_index != -1:
-            suffix = extended_suffix[:last_space_index]
-        else:
-            suffix = extended_suffix
-        return suffix
+        window_end = min(self.text_len, end + self.max_fix_len * 2)
+        while window_end > end and self.text[window_end - 1].isspace():
+            window_end -= 1
+        half_end = min(end + self.max_fix_len, window_end)
+        cut = max(self.text.rfind(' ', end, half_end),
+                  self.text.rfind('\n', end, half_end))
+        if cut != -1:
+            window_end = cut
+        return self.text[end:window_end].replace('\n', ' ')
 
     def _as_web_annotation(self, feature_structure: FeatureStructure, body):
         anno_id = self._annotation_id(feature_structure.xmiID)
         original_fs = feature_structure
-        if feature_structure['begin'] is None:
+        feature_structure_begin = feature_structure['begin']
+        if feature_structure_begin is None:
             feature_structure = feature_structure['target']
         if not feature_structure:
-            ic(original_fs)
-            logger.error("missing feature_structure")
+            logger.error(f"missing feature_structure for {original_fs}")
             exact = ""
+            feature_structure_begin = None
+            feature_structure_end = None
         else:
+            # cache the span fields: every FeatureStructure subscript goes through an attribute proxy
+            if feature_structure_begin is None:
+                feature_structure_begin = feature_structure['begin']
+            feature_structure_end = feature_structure['end']
             exact = feature_structure.get_covered_text()
         text_quote_selector = {
             "type": "TextQuoteSelector",
             "exact": exact
         }
-        prefix = self._get_prefix(feature_structure)
+        prefix = self._get_prefix(feature_structure_begin)
         if prefix:
             text_quote_selector['prefix'] = prefix
-        suffix = self._get_suffix(feature_structure)
+        suffix = self._get_suffix(feature_structure_end)
         if suffix:
             text_quote_selector['suffix'] = suffix
-        feature_structure_begin = feature_structure['begin']
-        feature_structure_end = feature_structure['end']
         targets = [
             {
                 "type": "SpecificResource",
@@ -247,12 +383,12 @@ class XMIProcessor:
                 ]
             }
         ]
-        overlapping_intervals = self.itree[feature_structure_begin:feature_structure_end]
+        overlapping_intervals = self._overlapping_intervals(feature_structure_begin, feature_structure_end)
         # logger.info(f"source interval: [{nea.begin},{nea.end}] {nea.get_covered_text()}")
         if len(overlapping_intervals) > 1:
             logger.warning(f">1 overlapping intervals for [{feature_structure_begin}:{feature_structure_end}]!")
-        for iv in sorted(list(overlapping_intervals)):
-            iv_begin, iv_end, iv_data = iv
+        # _overlapping_intervals already yields the intervals in begin order
+        for iv_begin, iv_end, iv_data in overlapping_intervals:
             # logger.info(f"overlapping interval: [{iv_begin},{iv_end}]")
             canvas_id = iv_data["canvas_id"]
             coords = iv_data["coords"]
@@ -264,15 +400,27 @@ class XMIProcessor:
             targets.append(self._canvas_target(canvas_id, xywh, manifest_uri))
 
         return {
-            "@context": "http://www.w3.org/ns/anno.jsonld",
+            "@context": anno_context,
             "id": anno_id,
             "type": "Annotation",
-            "generated": datetime.today().isoformat(),
+            "generated": self._generated,
             "generator": self._generator(),
             "body": body,
             "target": targets
         }
 
+    def _overlapping_intervals(self, begin: int, end: int) -> List[Tuple[int, int, Dict[str, Any]]]:
+        if begin is None or end is None:
+            # the missing-feature-structure error path has no span to match
+            return []
+        j = bisect.bisect_left(self._interval_begins, end) - 1
+        overlapping = []
+        while j >= 0 and self._interval_ends[j] > begin:
+            overlapping.append(self._intervals[j])
+            j -= 1
+        overlapping.reverse()
+        return overlapping
+
     def _generator(self):
         return {
             "id": "https://github.com/knaw-huc/globalise-tools/blob/"
@@ -284,20 +432,7 @@ class XMIProcessor:
 
     @staticmethod
     def _named_entity_body(feature_structure: FeatureStructure):
-        entity_id = feature_structure.value
-        ner_data = ner_data_dict[entity_id]
-        entity_uri = ner_data['uri']
-        entity_label = ner_data['label']
-        return [
-            {
-                "type": "SpecificResource",
-                "purpose": "classifying",
-                "source": {
-                    "id": entity_uri,
-                    "label": entity_label
-                }
-            }
-        ]
+        return ner_bodies[feature_structure.value]
 
     @staticmethod
     def _event_predicate_body(feature_structure: FeatureStructure):
@@ -307,27 +442,21 @@ class XMIProcessor:
         if not raw_category:
             logger.warning(f"no category for {feature_structure}")
         else:
-            category = raw_category.replace("+", "Plus").replace("-", "Min")
-            category_source = f"{wiki_base}{category}"
             bodies.append(
                 {
                     "purpose": "classifying",
-                    "source": category_source
+                    "source": category_url(raw_category)
                 }
             )
-            relation_type = f"{wiki_base}{feature_structure['relationtype']}"
             bodies.append({
                 "purpose": "classifying",
-                "source": relation_type
+                "source": wiki_url(feature_structure['relationtype'])
             })
         return bodies
 
     @staticmethod
     def _event_argument_body():
-        return {
-            "purpose": "classifying",
-            "source": "https://github.com/globalise-huygens/nlp-event-detection/wiki#EventArguments"
-        }
+        return event_argument_body
 
     def _as_event_link_web_annotation(
             self,
@@ -339,10 +468,10 @@ class XMIProcessor:
         target1_num = event_annotation_uri.split(':')[-1]
         target2_num = argument_annotation_uri.split(':')[-1]
         return {
-            "@context": "http://www.w3.org/ns/anno.jsonld",
+            "@context": anno_context,
             "id": self._annotation_id(f"{target1_num}-{target2_num}"),
             "type": "Annotation",
-            "generated": datetime.today().isoformat(),
+            "generated": self._generated,
             "generator": self._generator(),
             "motivation": "linking",
             "body": {
@@ -364,11 +493,7 @@ class XMIProcessor:
         return {
             "type": "Image",
             "source": f"{iiif_base_uri}/full/max/0/default.jpg",
-            "selector": {
-                "type": "FragmentSelector",
-                "conformsTo": "http://www.w3.org/TR/media-frags/",
-                "value": f"xywh={xywh}"
-            }
+            "selector": dict(fragment_selector_proto, value=f"xywh={xywh}")
         }
 
     @staticmethod
@@ -385,22 +510,22 @@ class XMIProcessor:
                     "type": "Manifest"
                 }
             },
-            "selector": {
-                "type": "FragmentSelector",
-                "conformsTo": "http://www.w3.org/TR/media-frags/",
-                "value": f"xywh={xywh}"
-            }
+            "selector": dict(fragment_selector_proto, value=f"xywh={xywh}")
         }
 
     @staticmethod
     def _to_xywh(coords: List[Tuple[int, int]]):
-        min_x = min([p[0] for p in coords])
-        min_y = min([p[1] for p in coords])
-        max_x = max([p[0] for p in coords])
-        max_y = max([p[1] for p in coords])
-        w = max_x - min_x
-        h = max_y - min_y
-        return f"{min_x},{min_y},{w},{h}"
+        min_x, min_y = max_x, max_y = coords[0]
+        for x, y in coords:
+            if x < min_x:
+                min_x = x
+            elif x > max_x:
+                max_x = x
+            if y < min_y:
+                min_y = y
+            elif y > max_y:
+                max_y = y
+        return f"{min_x},{min_y},{max_x - min_x},{max_y - min_y}"
 
     def _entity_inference_annotation(self, entity_annotation, entity_type: str, anno_num: any):
         raw_entity_name = entity_annotation["target"][0]['selector'][0]['exact']
@@ -411,16 +536,7 @@ class XMIProcessor:
         annotation_id = self._annotation_id(uuid.uuid4())
         entity_id = self._entity_id(start, end, normalized_entity_name)
         return {
-            "@context": [
-                "http://www.w3.org/ns/anno.jsonld",
-                {
-                    "prov": "http://www.w3.org/ns/prov#",
-                    "wasDerivedFrom": {
-                        "@id": "prov:wasDerivedFrom",
-                        "@type": "@id"
-                    }
-                }
-            ],
+            "@context": entity_inference_context,
             "id": annotation_id,
             "type": "Annotation",
             "body": {
@@ -440,30 +556,7 @@ class XMIProcessor:
         event_type = event_predicate_annotation['body'][0]['source']
         event_annotation_id = event_predicate_annotation['id']
         web_anno = {
-            "@context": [
-                "http://www.w3.org/ns/anno.jsonld",
-                {
-                    "prov": "http://www.w3.org/ns/prov#",
-                    "glob": "https://github.com/globalise-huygens/nlp-event-detection/wiki#",
-                    "sem": "http://semanticweb.cs.vu.nl/2009/11/sem/",
-                    "hasActor": "sem:hasActor",
-                    "hasTime": "sem:hasTime",
-                    "hasPlace": "sem:hasPlace",
-                    "Event": "sem:Event",
-                    "roleType": {
-                        "@id": "sem:roleType",
-                        "@type": "@id"
-                    },
-                    # "value": {
-                    #     "@id": "rdf:value",
-                    #     "@type": "@id"
-                    # },
-                    "wasDerivedFrom": {
-                        "@id": "prov:wasDerivedFrom",
-                        "@type": "@id"
-                    }
-                }
-            ],
+            "@context": event_inference_context,
             "id": annotation_id,
             "type": "Annotation",
             "body": {
@@ -524,20 +617,46 @@ class XMIProcessorFactory:
 
     def __init__(self, typesystem_path: str):
         logger.info(f"<= {typesystem_path}")
-        with open(typesystem_path, 'rb') as f:
-            self.typesystem = cas.load_typesystem(f)
+        self.typesystem = self._load_typesystem(typesystem_path)
         self.document_data = self._read_document_data()
+        self.document_data_md5_index = {v['plain_text_md5']: (k, v) for k, v in self.document_data.items()}
         self.commit_id = self._read_current_commit_id()
 
     def get_xmi_processor(self, xmi_path: str) -> XMIProcessor:
-        return XMIProcessor(self.typesystem, self.document_data, self.commit_id, xmi_path)
+        return XMIProcessor(self.typesystem, self.document_data_md5_index, self.commit_id, xmi_path)
+
+    @staticmethod
+    def _load_typesystem(typesystem_path: str):
+        # parsing the TypeSystem xml is expensive, so keep a pickle next to it
+        # and reuse that as long as the xml has not been modified; batched runs
+        # reuse the factory (and thus the parse) for all their xmi files anyway
+        cache_path = typesystem_path + ".pkl"
+        try:
+            if os.path.getmtime(cache_path) >= os.path.getmtime(typesystem_path):
+                with open(cache_path, 'rb') as f:
+                    return pickle.load(f)
+        except Exception:
+            # missing, stale or corrupt cache: fall through and reparse
+            pass
+        with open(typesystem_path, 'rb') as f:
+            typesystem = cas.load_typesystem(f)
+        try:
+            # write to a per-process temp file and rename it into place, so
+            # concurrent workers on a cold cache never leave a torn pickle
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(typesystem, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            logger.warning(f"could not write typesystem cache {cache_path}")
+        return typesystem
 
     @staticmethod
     def _read_document_data() -> Dict[str, Any]:
         path = "data/document_data.json"
         logger.info(f"<= {path}")
-        with open(path) as f:
-            return json.load(f)
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
 
     @staticmethod
     def _read_current_commit_id():
@@ -570,28 +689,47 @@ def get_arguments():
     return parser.parse_args()
 
 
+_worker_factory = None
+
+
+def _init_worker(typesystem_path: str):
+    global _worker_factory
+    _worker_factory = XMIProcessorFactory(typesystem_path)
+
+
+def _process_xmi(xmi_path: str, output_dir: str):
+    basename = xmi_path.split('/')[-1].replace('.xmi', '').replace(' ', "_")
+    xp = _worker_factory.get_xmi_processor(xmi_path)
+
+    txt_path = f"{output_dir}/{basename}_plain-text.txt"
+    logger.info(f"=> {txt_path}")
+    with open(txt_path, 'w') as f:
+        f.write(xp.text)
+
+    nea = xp.get_named_entity_annotations()
+    entity_ids = [a['body']['id'] for _, a in nea if 'id' in a['body']]
+    eva = xp.get_event_annotations(entity_ids)
+    json_path = f"{output_dir}/{basename}_web-annotations.json"
+    logger.info(f"=> {json_path}")
+    all_web_annotations = [p[1] for p in heapq.merge(nea, eva, key=itemgetter(0))]
+    with open(json_path, 'wb') as f:
+        f.write(orjson.dumps(all_web_annotations, option=orjson.OPT_INDENT_2))
+
+
 @logger.catch
 def extract_web_annotations(xmi_paths: List[str], typesystem_path: str, output_dir: str):
     if not output_dir:
         output_dir = "."
-    xpf = XMIProcessorFactory(typesystem_path)
-    for xmi_path in xmi_paths:
-        basename = xmi_path.split('/')[-1].replace('.xmi', '').replace(' ', "_")
-        xp = xpf.get_xmi_processor(xmi_path)
-
-        txt_path = f"{output_dir}/{basename}_plain-text.txt"
-        logger.info(f"=> {txt_path}")
-        with open(txt_path, 'w') as f:
-            f.write(xp.text)
-
-        nea = xp.get_named_entity_annotations()
-        entity_ids = [a['body']['id'] for a in nea if 'id' in a['body']]
-        eva = xp.get_event_annotations(entity_ids)
-        json_path = f"{output_dir}/{basename}_web-annotations.json"
-        logger.info(f"=> {json_path}")
-        all_web_annotations = (nea + eva)
-        with open(json_path, 'w') as f:
-            json.dump(all_web_annotations, f, indent=2)
+    if len(xmi_paths) == 1:
+        _init_worker(typesystem_path)
+        _process_xmi(xmi_paths[0], output_dir)
+    else:
+        # each file writes to its own basename_* paths, so the files can be
+        # processed independently; the typesystem is parsed once per worker
+        with ProcessPoolExecutor(max_workers=os.cpu_count(),
+                                 initializer=_init_worker,
+                                 initargs=(typesystem_path,)) as executor:
+            list(executor.map(partial(_process_xmi, output_dir=output_dir), xmi_paths))
 
 
 if __name__ == '__main__':